@@ -4,6 +4,10 @@ GMAIL_PASSWORD = "REDACTED"
 ANTHROPIC_API_KEY = "wazaaaaa"
 
 GMAIL_MAX_RESULTS = 100
+GMAIL_POOL_SIZE = 4
+ASYNC_MODE = False
+LLM_BATCH_MODE = False  # Message Batches API: cheaper, but a batch can take hours to end
+LLM_BATCH_TIMEOUT = 30 * 60  # Seconds to wait for a batch; unfinished messages are retried next run
 MAX_LLM_CALLS_PER_RUN = 50
 
 # Google Sheets
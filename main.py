@@ -1,7 +1,19 @@
-from services.gmail_client import GmailClient
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.gmail_client import MAX_SEARCH_RESULTS, GmailClient, extract_message_data
+from services.models import Order
 from services.wine_detector import WineOrderDetector
 from services.llm_extractor import WineLLMExtractor
-from services.sheets_client import append_wines_to_sheet, get_last_sync_date
+from services.llm_cache import LLMCache
+from services.sheets_client import (
+    append_wines_to_sheet,
+    get_last_sync_date,
+    get_last_uid,
+    get_synced_uids,
+    save_last_uid,
+)
 from utils.logger import logger
 import config
 
@@ -14,43 +26,202 @@ def main():
     if last_sync:
         logger.info(f"Last sync: {last_sync}")
     
-    gmail = GmailClient(config.GMAIL_EMAIL, config.GMAIL_PASSWORD)
+    gmail = GmailClient(config.GMAIL_EMAIL, config.GMAIL_PASSWORD, pool_size=config.GMAIL_POOL_SIZE)
+    llm, detector = _build_detector(batch_mode=config.LLM_BATCH_MODE)
+    
+    uidvalidity = gmail.get_uidvalidity()
+    last_uid, synced_uids = _get_uid_state(uidvalidity)
+    
+    max_results = _search_limit(synced_uids)
+    message_ids = gmail.search_message_ids(
+        max_results=max_results,
+        merchant_domains=config.WINE_MERCHANT_DOMAINS,
+        since=last_sync,
+        after_uid=last_uid,
+    )
+    pending_ids = [uid for uid in message_ids if int(uid) not in synced_uids]
+    previews = gmail.fetch_envelopes(pending_ids)
+    logger.info(f"Fetched {len(previews)} email previews")
+    
+    candidate_ids = [
+        msg_id for msg_id, preview in previews.items()
+        if _is_new(preview, last_sync) and detector.is_wine_order(preview)
+    ]
+    messages = gmail.fetch_full(candidate_ids)
+    logger.info(f"Fetched {len(messages)} candidate emails")
+    
+    message_data = [extract_message_data(msg) for msg in messages]
+    gmail.close()
+    
+    if detector.batch_mode:
+        for data in message_data:
+            detector.extract_order_details(data, config.MAX_LLM_CALLS_PER_RUN)
+        wine_orders = detector.finalize_batch()
+    else:
+        wine_orders = detector.extract_order_details_many(message_data, config.MAX_LLM_CALLS_PER_RUN)
+    for order in wine_orders:
+        logger.info(f"Found order: {order.subject[:50]}")
+    
+    processed = set(previews) - set(candidate_ids)
+    processed.update(data['id'] for data in message_data)
+    processed -= detector.unresolved_ids
+    complete = processed.issuperset(pending_ids) and len(message_ids) < max_results
+    
+    if _export(wine_orders, llm, update_sync_date=complete):
+        _save_uid_state(uidvalidity, last_uid, synced_uids, message_ids, processed)
+
+
+async def main_async():
+    """Async pipeline: IMAP fetches, MIME parsing and LLM calls overlap instead of running in sequence."""
+    from services.async_gmail_client import AsyncGmailClient
+    
+    logger.info("WineSync - Starting (async)...")
+    
+    last_sync = get_last_sync_date()
+    if last_sync:
+        logger.info(f"Last sync: {last_sync}")
+    
+    gmail = AsyncGmailClient(config.GMAIL_EMAIL, config.GMAIL_PASSWORD)
+    await gmail.connect()
+    llm, detector = _build_detector()
+    
+    uidvalidity = await gmail.get_uidvalidity()
+    last_uid, synced_uids = _get_uid_state(uidvalidity)
+    
+    max_results = _search_limit(synced_uids)
+    message_ids = await gmail.search_message_ids(
+        max_results=max_results,
+        merchant_domains=config.WINE_MERCHANT_DOMAINS,
+        since=last_sync,
+        after_uid=last_uid,
+    )
+    pending_ids = [uid for uid in message_ids if int(uid) not in synced_uids]
+    logger.info(f"Found {len(pending_ids)} candidate emails")
+    
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    fetched_ids: Set[str] = set()
+    
+    async def produce() -> None:
+        await gmail.fetch_full(pending_ids, queue)
+        await queue.put(None)
+    
+    async def process(msg: Dict) -> Optional[Order]:
+        fetched_ids.add(msg['id'])
+        message_data = await loop.run_in_executor(None, extract_message_data, msg)
+        if not _is_new(message_data, last_sync) or not detector.is_wine_order(message_data):
+            return None
+        return await detector.extract_order_details_async(message_data, config.MAX_LLM_CALLS_PER_RUN)
+    
+    async def consume() -> List[Optional[Order]]:
+        tasks = []
+        while (msg := await queue.get()) is not None:
+            tasks.append(asyncio.create_task(process(msg)))
+        return await asyncio.gather(*tasks)
+    
+    _, orders = await asyncio.gather(produce(), consume())
+    await gmail.close()
+    
+    wine_orders = [order for order in orders if order]
+    for order in wine_orders:
+        logger.info(f"Found order: {order.subject[:50]}")
     
+    processed = fetched_ids - detector.unresolved_ids
+    complete = processed.issuperset(pending_ids) and len(message_ids) < max_results
+    
+    if _export(wine_orders, llm, update_sync_date=complete):
+        _save_uid_state(uidvalidity, last_uid, synced_uids, message_ids, processed)
+
+
+def _build_detector(batch_mode: bool = False) -> Tuple[Optional[WineLLMExtractor], WineOrderDetector]:
+    """Build the optional LLM extractor and the wine order detector."""
     llm = None
     if config.ANTHROPIC_API_KEY:
-        llm = WineLLMExtractor(config.ANTHROPIC_API_KEY)
+        llm = WineLLMExtractor(config.ANTHROPIC_API_KEY, cache=LLMCache())
     
     detector = WineOrderDetector(
         keywords=[],
         merchant_domains=config.WINE_MERCHANT_DOMAINS,
-        llm_extractor=llm
+        llm_extractor=llm,
+        batch_mode=batch_mode
     )
+    return llm, detector
+
+
+def _is_new(message_data: Dict, last_sync: Optional[datetime]) -> bool:
+    """Check that a message was received after the last sync."""
+    email_date = message_data.get('date')
+    return not (last_sync and email_date and email_date <= last_sync)
+
+
+def _get_uid_state(uidvalidity: Optional[int]) -> Tuple[Optional[int], Set[int]]:
+    """Load the UID watermark and the UIDs already synced above it; a changed UIDVALIDITY means a full sync."""
+    if not uidvalidity:
+        return None, set()
+    last_uid = get_last_uid(uidvalidity)
+    if last_uid:
+        logger.info(f"Last synced UID: {last_uid}")
+    return last_uid, get_synced_uids(uidvalidity)
+
+
+def _search_limit(synced_uids: Set[int]) -> int:
+    """UIDs to ask the search for: GMAIL_MAX_RESULTS new ones plus the already-synced ones it returns again.
     
-    messages = gmail.fetch_messages(query='ALL', max_results=config.GMAIL_MAX_RESULTS)
-    logger.info(f"Fetched {len(messages)} emails")
-    
-    wine_orders = []
-    for msg in messages:
-        message_data = gmail.extract_message_data(msg)
-        
-        email_date = message_data.get('date')
-        if last_sync and email_date and email_date <= last_sync:
-            continue
-        
-        if detector.is_wine_order(message_data):
-            order = detector.extract_order_details(message_data, config.MAX_LLM_CALLS_PER_RUN)
-            if order:
-                wine_orders.append(order)
-                logger.info(f"Found order: {order.get('subject', '')[:50]}")
+    Capped at MAX_SEARCH_RESULTS, so fewer results than this always means the
+    search was not truncated and the run may advance the last sync date.
+    """
+    return min(config.GMAIL_MAX_RESULTS + len(synced_uids), MAX_SEARCH_RESULTS)
+
+
+def _save_uid_state(
+    uidvalidity: Optional[int],
+    last_uid: Optional[int],
+    synced_uids: Set[int],
+    message_ids: List[str],
+    processed_ids: Iterable[str],
+) -> None:
+    """Advance the UID watermark over the contiguous run of processed messages.
     
-    gmail.close()
+    A message that failed to fetch, failed LLM extraction or hit the call cap
+    stops the watermark; processed UIDs above it are saved so the next run
+    only retries the gap.
+    """
+    if not uidvalidity or not message_ids:
+        return
+    
+    done = synced_uids | {int(uid) for uid in processed_ids}
+    watermark = _uid_watermark(last_uid, message_ids, done)
+    save_last_uid(uidvalidity, watermark, synced_uids={uid for uid in done if uid > (watermark or 0)})
+
+
+def _uid_watermark(last_uid: Optional[int], message_ids: List[str], done: Set[int]) -> Optional[int]:
+    """Highest searched UID such that it and every searched UID below it are done."""
+    watermark = last_uid
+    for uid in sorted(int(uid) for uid in message_ids):
+        if uid not in done:
+            break
+        watermark = uid
+    return watermark
+
+
+def _export(wine_orders: List[Order], llm: Optional[WineLLMExtractor], update_sync_date: bool) -> bool:
+    """Append found orders to Google Sheets and log the LLM usage.
     
+    Returns:
+        True if the export succeeded
+    """
     logger.info(f"Found {len(wine_orders)} wine orders")
-    append_wines_to_sheet(wine_orders)
+    if not update_sync_date:
+        logger.info("Some messages are still pending; keeping the last sync date")
+    exported = append_wines_to_sheet(wine_orders, update_sync_date=update_sync_date)
     
     if llm:
         logger.info(f"LLM calls: {llm.get_call_count()}")
+    return exported
 
 
 if __name__ == '__main__':
-    main()
+    if config.ASYNC_MODE:
+        asyncio.run(main_async())
+    else:
+        main()
@@ -0,0 +1,153 @@
+import asyncio
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aioimaplib
+
+from services.gmail_client import (
+    FETCH_BATCH_SIZE,
+    FULL_FETCH_PARTS,
+    MAX_SEARCH_RESULTS,
+    build_gmail_raw_query,
+    fetch_section_name,
+    format_imap_date,
+    parse_message_parts,
+    parse_uidvalidity,
+    quote_imap_string,
+)
+from utils.logger import logger
+
+_FETCH_UID_RE = re.compile(rb"^\d+ FETCH \(.*?UID (\d+)")
+
+
+class AsyncGmailClient:
+    """Asyncio client for Gmail IMAP, overlapping fetches with MIME parsing."""
+    
+    def __init__(self, email_address: str, password: str, max_concurrent_fetches: int = 8):
+        """Initialize async Gmail client with credentials.
+        
+        Args:
+            email_address: Gmail email address
+            password: Gmail app-specific password
+            max_concurrent_fetches: Maximum number of FETCH commands in flight
+        """
+        self.email_address = email_address
+        self.password = password
+        self.imap = None
+        self._semaphore = asyncio.Semaphore(max_concurrent_fetches)
+    
+    async def connect(self) -> None:
+        """Connect to Gmail IMAP server and select INBOX."""
+        if not self.email_address or not self.password:
+            raise ValueError("Email and password are required")
+        
+        self.imap = aioimaplib.IMAP4_SSL("imap.gmail.com")
+        await self.imap.wait_hello_from_server()
+        
+        response = await self.imap.login(self.email_address, self.password)
+        if response.result != "OK":
+            logger.error(f"IMAP authentication failed: {response.lines}")
+            raise ValueError("IMAP authentication failed")
+        
+        await self.imap.select("INBOX")
+    
+    async def search_message_ids(
+        self,
+        max_results: int = 100,
+        merchant_domains: Optional[List[str]] = None,
+        keywords: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        after_uid: Optional[int] = None,
+    ) -> List[str]:
+        """Search INBOX and return the oldest matching UIDs above after_uid, oldest first (see GmailClient)."""
+        if not self.imap:
+            raise ValueError("Gmail connection not established")
+        
+        safe_max_results = max(1, min(max_results, MAX_SEARCH_RESULTS))
+        
+        criteria = ['UID', f'{after_uid + 1}:*'] if after_uid else []
+        if since:
+            criteria += ['SINCE', format_imap_date(since)]
+        raw_query = build_gmail_raw_query(merchant_domains, keywords)
+        if raw_query:
+            criteria += ['X-GM-RAW', quote_imap_string(raw_query)]
+        
+        try:
+            response = await self.imap.uid_search(*(criteria or ['ALL']))
+        except Exception as exc:
+            logger.error(f"IMAP search error: {exc}")
+            return []
+        if response.result != "OK" or not response.lines or not response.lines[0]:
+            return []
+        
+        uids = sorted(
+            (uid for uid in response.lines[0].decode().split() if int(uid) > (after_uid or 0)),
+            key=int,
+        )
+        return uids[:safe_max_results]
+    
+    async def get_uidvalidity(self) -> Optional[int]:
+        """Return INBOX UIDVALIDITY; stored UIDs are only valid while it is unchanged."""
+        try:
+            response = await self.imap.status("INBOX", "(UIDVALIDITY UIDNEXT)")
+        except Exception as exc:
+            logger.error(f"IMAP status error: {exc}")
+            return None
+        if response.result != "OK" or not response.lines:
+            return None
+        return parse_uidvalidity(response.lines[0])
+    
+    async def fetch_full(self, uids: List[str], queue: asyncio.Queue) -> None:
+        """Fetch complete messages and put parsed message dictionaries on the queue.
+        
+        MIME parsing runs in the default executor so the next FETCH can be
+        received while the previous batch is parsed.
+        """
+        chunks = [uids[start:start + FETCH_BATCH_SIZE] for start in range(0, len(uids), FETCH_BATCH_SIZE)]
+        await asyncio.gather(*(self._fetch_chunk(chunk, queue) for chunk in chunks))
+    
+    async def _fetch_chunk(self, chunk: List[str], queue: asyncio.Queue) -> None:
+        """Fetch one UID set and enqueue its messages."""
+        async with self._semaphore:
+            try:
+                response = await self.imap.uid("fetch", ",".join(chunk), FULL_FETCH_PARTS)
+            except Exception as exc:
+                logger.error(f"Failed to fetch messages {chunk[0]}..{chunk[-1]}: {exc}")
+                return
+        if response.result != "OK":
+            return
+        
+        lines = response.lines
+        sections: Dict[str, Dict[str, bytes]] = {}
+        uid = None
+        for index, line in enumerate(lines[:-1]):
+            if not isinstance(line, bytes):
+                continue
+            uid_match = _FETCH_UID_RE.match(line)
+            if uid_match:
+                uid = uid_match.group(1).decode()
+            section = fetch_section_name(line)
+            if uid and section:
+                sections.setdefault(uid, {})[section] = bytes(lines[index + 1])
+        
+        loop = asyncio.get_running_loop()
+        for uid, parts in sections.items():
+            try:
+                msg = await loop.run_in_executor(None, parse_message_parts, parts)
+            except Exception as exc:
+                logger.error(f"Failed to parse message {uid}: {exc}")
+                continue
+            await queue.put({
+                'id': uid,
+                'raw_message': msg
+            })
+    
+    async def close(self) -> None:
+        """Close IMAP connection."""
+        if self.imap:
+            try:
+                await self.imap.close()
+                await self.imap.logout()
+            except:
+                pass
@@ -1,34 +1,67 @@
 import imaplib
-import email
-from email.header import decode_header
-from typing import List, Dict, Tuple
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email import policy
+from email.message import Message
+from email.parser import BytesFeedParser, BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Optional, Tuple
+
+from selectolax.lexbor import LexborHTMLParser
 
 from utils.logger import logger
 
+FETCH_BATCH_SIZE = 50
+MAX_SEARCH_RESULTS = 500
+PREVIEW_FETCH_PARTS = "(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)] BODY.PEEK[TEXT]<0.512>)"
+FULL_FETCH_PARTS = "(BODY.PEEK[HEADER] BODY.PEEK[TEXT])"
+
+_FETCH_ID_RE = re.compile(rb"^\d+ \(.*?UID (\d+)")
+_UIDVALIDITY_RE = re.compile(rb"UIDVALIDITY (\d+)")
+_FETCH_SECTION_RE = re.compile(rb"(?:BODY\[([A-Z0-9.]*)[^\]]*\](?:<\d+>)?|(RFC822)) \{\d+\}$")
+_LINE_BREAKS_RE = re.compile(r"\s*\n\s*")
+
 
 class GmailClient:
     """Client for interacting with Gmail via IMAP."""
     
-    def __init__(self, email_address: str, password: str):
+    def __init__(self, email_address: str, password: str, pool_size: int = 4):
         """Initialize Gmail client with credentials.
         
         Args:
             email_address: Gmail email address
             password: Gmail app-specific password
+            pool_size: Number of IMAP connections used for parallel fetches
+                (Gmail allows up to 15 per account)
         """
         self.email_address = email_address
         self.password = password
+        self.pool_size = max(1, min(pool_size, 15))
         self.imap = None
+        self._connections: List[imaplib.IMAP4_SSL] = []
+        self._pool: "queue.Queue[imaplib.IMAP4_SSL]" = queue.Queue()
         self._connect()
     
     def _connect(self) -> None:
-        """Connect to Gmail IMAP server."""
+        """Open the connection pool; the first connection also serves searches."""
         if not self.email_address or not self.password:
             raise ValueError("Email and password are required")
         
+        for _ in range(self.pool_size):
+            connection = self._open_connection()
+            self._connections.append(connection)
+            self._pool.put(connection)
+        self.imap = self._connections[0]
+    
+    def _open_connection(self) -> imaplib.IMAP4_SSL:
+        """Connect to Gmail IMAP server and select INBOX."""
         try:
-            self.imap = imaplib.IMAP4_SSL("imap.gmail.com")
-            self.imap.login(self.email_address, self.password)
+            connection = imaplib.IMAP4_SSL("imap.gmail.com")
+            connection.login(self.email_address, self.password)
+            connection.select("INBOX")
+            return connection
         except imaplib.IMAP4.error as exc:
             logger.error(f"IMAP authentication failed: {exc}")
             raise
@@ -36,164 +69,365 @@ class GmailClient:
             logger.error(f"IMAP connection error: {exc}")
             raise
     
-    def fetch_messages(self, query: str = 'ALL', max_results: int = 100) -> List[Dict]:
-        """Fetch messages from Gmail.
+    def search_message_ids(
+        self,
+        query: str = 'ALL',
+        max_results: int = 100,
+        merchant_domains: Optional[List[str]] = None,
+        keywords: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        after_uid: Optional[int] = None,
+    ) -> List[str]:
+        """Search INBOX and return the oldest matching message UIDs above after_uid.
+        
+        Oldest first, so a run capped by max_results leaves no gap below the
+        UIDs it returns and the next run continues where this one stopped.
+        When merchant domains or keywords are given, filtering is done
+        server-side with Gmail's X-GM-RAW search so only candidate emails
+        are downloaded.
         
         Args:
-            query: IMAP search query (default: 'ALL')
-            max_results: Maximum number of messages to fetch
+            query: IMAP search query used when no domains/keywords are given (default: 'ALL')
+            max_results: Maximum number of message IDs to return, at most MAX_SEARCH_RESULTS
+            merchant_domains: Sender domains to match (from:)
+            keywords: Subject keywords to match (subject:)
+            since: Only return messages received on or after this date
+            after_uid: Only return messages with a greater UID (incremental sync)
             
         Returns:
-            List of message dictionaries
+            Message UIDs, oldest first
         """
         if not self.imap:
             raise ValueError("Gmail connection not established")
         
-        safe_max_results = max(1, min(max_results, 500))
+        safe_max_results = max(1, min(max_results, MAX_SEARCH_RESULTS))
         
         try:
             select_status, _ = self.imap.select("INBOX")
             if select_status != "OK":
                 return []
             
-            status, message_ids = self.imap.search(None, query)
+            charset, criteria = self._build_search_criteria(query, merchant_domains, keywords, since)
+            if after_uid:
+                criteria = ['UID', f'{after_uid + 1}:*'] + criteria
+            if charset:
+                criteria = ['CHARSET', charset] + criteria
+            status, message_ids = self.imap.uid('SEARCH', *criteria)
             if status != "OK" or not message_ids or not message_ids[0]:
                 return []
         except Exception as exc:
             logger.error(f"IMAP search error: {exc}")
             return []
         
-        message_id_list = message_ids[0].split()
-        message_id_list.reverse()
+        message_id_list = sorted(
+            (uid for uid in message_ids[0].decode().split() if int(uid) > (after_uid or 0)),
+            key=int,
+        )
+        return message_id_list[:safe_max_results]
+    
+    def get_uidvalidity(self) -> Optional[int]:
+        """Return INBOX UIDVALIDITY; stored UIDs are only valid while it is unchanged."""
+        try:
+            status, data = self.imap.status("INBOX", "(UIDVALIDITY UIDNEXT)")
+        except Exception as exc:
+            logger.error(f"IMAP status error: {exc}")
+            return None
+        if status != "OK" or not data or not data[0]:
+            return None
+        return parse_uidvalidity(data[0])
+    
+    def fetch_envelopes(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch lightweight previews (From/Subject/Date + body start) without attachments.
+        
+        Args:
+            message_ids: Message IDs to preview
+            
+        Returns:
+            Preview dictionaries keyed by message ID
+        """
+        sections = self._fetch_sections(message_ids, PREVIEW_FETCH_PARTS)
+        
+        previews: Dict[str, Dict] = {}
+        for msg_id, parts in sections.items():
+            headers = BytesHeaderParser(policy=policy.default).parsebytes(parts.get("HEADER.FIELDS", b""))
+            previews[msg_id] = {
+                'id': msg_id,
+                'subject': str(headers.get("Subject", "")),
+                'from': str(headers.get("From", "")),
+                'date': _parse_date(headers.get("Date", "")),
+                'snippet': parts.get("TEXT", b"").decode("utf-8", errors="ignore"),
+            }
+        
+        return previews
+    
+    def fetch_full(self, message_ids: List[str]) -> List[Dict]:
+        """Fetch and parse complete messages, attachments included.
+        
+        Args:
+            message_ids: Message IDs to download
+            
+        Returns:
+            List of message dictionaries
+        """
+        sections = self._fetch_sections(message_ids, FULL_FETCH_PARTS)
         
         messages: List[Dict] = []
-        for msg_id in message_id_list[:safe_max_results]:
+        for msg_id, parts in sections.items():
             try:
-                fetch_status, msg_data = self.imap.fetch(msg_id, "(RFC822)")
-                if fetch_status != "OK":
-                    continue
-                
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        messages.append({
-                            'id': msg_id.decode(),
-                            'raw_message': msg
-                        })
+                msg = parse_message_parts(parts)
             except Exception as exc:
-                logger.error(f"Failed to fetch or parse message {msg_id}: {exc}")
+                logger.error(f"Failed to parse message {msg_id}: {exc}")
                 continue
+            messages.append({
+                'id': msg_id,
+                'raw_message': msg
+            })
         
         return messages
     
-    
-    def extract_message_data(self, message: Dict) -> Dict:
-        """Extract relevant data from a Gmail message.
+    def _fetch_sections(self, message_ids: List[str], parts: str) -> Dict[str, Dict[str, bytes]]:
+        """Fetch message parts in parallel over the connection pool, up to FETCH_BATCH_SIZE IDs per command.
         
-        Args:
-            message: Message dictionary with raw_message
-            
         Returns:
-            Dictionary with extracted message data
+            Mapping of message ID to {section name: payload}, e.g. "RFC822", "TEXT"
         """
-        msg = message.get('raw_message')
+        if not self.imap:
+            raise ValueError("Gmail connection not established")
         
-        subject = self._decode_header(msg.get("Subject", ""))
-        from_email = self._decode_header(msg.get("From", ""))
-        date = msg.get("Date", "")
+        batch_size = max(1, min(FETCH_BATCH_SIZE, -(-len(message_ids) // self.pool_size)))
+        chunks = [message_ids[start:start + batch_size] for start in range(0, len(message_ids), batch_size)]
         
-        body = self._extract_body(msg)
-        snippet = body[:200] if body else ""
+        results: Dict[str, Dict[str, bytes]] = {}
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            for chunk_results in executor.map(lambda chunk: self._fetch_chunk(chunk, parts), chunks):
+                results.update(chunk_results)
+        
+        return results
+    
+    def _fetch_chunk(self, chunk: List[str], parts: str) -> Dict[str, Dict[str, bytes]]:
+        """Fetch one ID set on an idle pooled connection."""
+        connection = self._pool.get()
+        try:
+            fetch_status, msg_data = connection.uid('FETCH', ",".join(chunk), parts)
+            if fetch_status != "OK":
+                return {}
+        except Exception as exc:
+            logger.error(f"Failed to fetch messages {chunk[0]}..{chunk[-1]}: {exc}")
+            return {}
+        finally:
+            self._pool.put(connection)
         
-        attachments = self._extract_attachments(msg)
+        results: Dict[str, Dict[str, bytes]] = {}
+        msg_id = None
+        for response_part in msg_data:
+            if not isinstance(response_part, tuple):
+                continue
+            id_match = _FETCH_ID_RE.match(response_part[0])
+            if id_match:
+                msg_id = id_match.group(1).decode()
+            section = fetch_section_name(response_part[0])
+            if not msg_id or not section:
+                continue
+            results.setdefault(msg_id, {})[section] = response_part[1]
         
-        return {
-            'id': message.get('id'),
-            'thread_id': '',
-            'subject': subject,
-            'from': from_email,
-            'date': date,
-            'body': body,
-            'snippet': snippet,
-            'attachments': attachments,
-        }
+        return results
     
-    def _decode_header(self, header: str) -> str:
-        """Decode email header.
+    def _build_search_criteria(
+        self,
+        query: str,
+        merchant_domains: Optional[List[str]],
+        keywords: Optional[List[str]],
+        since: Optional[datetime],
+    ) -> Tuple[Optional[str], List[str]]:
+        """Build IMAP SEARCH charset and criteria.
         
-        Args:
-            header: Email header string
-            
-        Returns:
-            Decoded header string
+        The X-GM-RAW expression is sent as a UTF-8 literal so accented
+        keywords (e.g. "vente à distance") don't break the ASCII command line.
         """
-        if not header:
-            return ""
-        
-        decoded_parts = decode_header(header)
-        decoded_header = ""
-        
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                if encoding:
-                    decoded_header += part.decode(encoding, errors='ignore')
-                else:
-                    decoded_header += part.decode('utf-8', errors='ignore')
-            else:
-                decoded_header += part
-        
-        return decoded_header
-    
-    def _extract_body(self, msg) -> str:
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_maintype() == "multipart":
-                    continue
-                if "attachment" in str(part.get("Content-Disposition", "")).lower():
-                    continue
-                if part.get_content_type() == "text/plain":
-                    payload = part.get_payload(decode=True) or b""
-                    return payload.decode("utf-8", errors="ignore")
-            for part in msg.walk():
-                if part.get_content_type() == "text/html":
-                    payload = part.get_payload(decode=True) or b""
-                    return payload.decode("utf-8", errors="ignore")
-            return ""
-        payload = msg.get_payload(decode=True) or b""
-        return payload.decode("utf-8", errors="ignore") if isinstance(payload, (bytes, bytearray)) else str(payload)
-    
-    def _extract_attachments(self, msg) -> List[Tuple[str, bytes]]:
-        attachments: List[Tuple[str, bytes]] = []
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_disposition = str(part.get("Content-Disposition", ""))
-                content_type = part.get_content_type()
-                
-                if "attachment" in content_disposition or content_type == "application/pdf":
-                    filename = part.get_filename()
-                    if not filename:
-                        continue
-                    
-                    filename = self._decode_header(filename)
-                    if not filename.lower().endswith('.pdf'):
-                        continue
-                    
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            attachments.append((filename, payload))
-                    except Exception as exc:
-                        logger.warning(f"Failed to decode attachment {filename}: {exc}")
-                        continue
-        
-        return attachments
+        criteria = ['SINCE', format_imap_date(since)] if since else []
+        
+        raw_query = build_gmail_raw_query(merchant_domains, keywords)
+        if not raw_query:
+            return None, criteria + [query]
+        
+        self.imap.literal = raw_query.encode("utf-8")
+        return "UTF-8", criteria + ['X-GM-RAW']
     
     def close(self) -> None:
-        """Close IMAP connection."""
-        if self.imap:
+        """Close all IMAP connections."""
+        for connection in self._connections:
             try:
-                self.imap.close()
-                self.imap.logout()
+                connection.close()
+                connection.logout()
             except:
                 pass
+
+
+def fetch_section_name(response_line: bytes) -> Optional[str]:
+    """Name of the literal announced by a FETCH response line, e.g. "HEADER", "TEXT", "RFC822"."""
+    section_match = _FETCH_SECTION_RE.search(response_line)
+    if not section_match:
+        return None
+    return (section_match.group(1) or section_match.group(2)).decode()
+
+
+def parse_message_parts(parts: Dict[str, bytes]) -> Message:
+    """Stream the fetched HEADER and TEXT sections into a single message.
+    
+    The default policy decodes headers and lets text parts be read with
+    their declared charset.
+    """
+    parser = BytesFeedParser(policy=policy.default)
+    parser.feed(parts.get("HEADER", b""))
+    parser.feed(parts.get("TEXT", b""))
+    return parser.close()
+
+
+def parse_uidvalidity(status_line: bytes) -> Optional[int]:
+    """Read UIDVALIDITY from a STATUS response line."""
+    match = _UIDVALIDITY_RE.search(status_line)
+    return int(match.group(1)) if match else None
+
+
+def build_gmail_raw_query(merchant_domains: Optional[List[str]], keywords: Optional[List[str]]) -> str:
+    """Build a Gmail search expression matching merchant senders or subject keywords.
+    
+    Gmail phrases cannot contain double quotes, so they are dropped from keywords.
+    """
+    terms = []
+    if merchant_domains:
+        terms.append(f"from:({' OR '.join(merchant_domains)})")
+    if keywords:
+        phrases = (kw.replace('"', '') for kw in keywords)
+        terms.append("subject:(" + " OR ".join(f'"{phrase}"' for phrase in phrases) + ")")
+    return " OR ".join(terms)
+
+
+def quote_imap_string(value: str) -> str:
+    """Quote a value as an IMAP quoted string, escaping backslashes and double quotes."""
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def format_imap_date(date: datetime) -> str:
+    """Format a date for IMAP SINCE/BEFORE criteria (DD-Mon-YYYY)."""
+    return date.strftime('%d-%b-%Y')
+
+
+def extract_message_data(message: Dict) -> Dict:
+    """Extract relevant data from a Gmail message.
+    
+    Args:
+        message: Message dictionary with raw_message
+        
+    Returns:
+        Dictionary with extracted message data
+    """
+    msg = message.get('raw_message')
+    
+    subject = str(msg.get("Subject", ""))
+    from_email = str(msg.get("From", ""))
+    date = _parse_date(msg.get("Date", ""))
+    
+    body, html = _extract_body(msg)
+    snippet = body[:200] if body else ""
+    
+    attachments = _extract_attachments(msg)
+    
+    return {
+        'id': message.get('id'),
+        'thread_id': '',
+        'subject': subject,
+        'from': from_email,
+        'date': date,
+        'body': body,
+        'html': html,
+        'snippet': snippet,
+        'attachments': attachments,
+    }
+
+
+def _parse_date(value: str) -> Optional[datetime]:
+    """Parse a Date header into a timezone-aware datetime.
+    
+    Naive results (e.g. "-0000" offsets) are assumed UTC so they can be
+    compared with the last sync date.
+    """
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def _extract_body(msg) -> Tuple[str, str]:
+    """Return (text body, raw HTML body); the HTML is kept for template extractors."""
+    if msg.is_multipart():
+        text_part = html_part = None
+        for part in msg.walk():
+            if part.get_content_maintype() == "multipart" or part.get_content_disposition() == "attachment":
+                continue
+            content_type = part.get_content_type()
+            if content_type == "text/plain" and text_part is None:
+                text_part = part
+            elif content_type == "text/html" and html_part is None:
+                html_part = part
+        html = _part_text(html_part) if html_part is not None else ""
+        if text_part is not None:
+            return _part_text(text_part), html
+        return (_html_to_text(html) if html else ""), html
+    body = _part_text(msg)
+    if msg.get_content_type() == "text/html":
+        return _html_to_text(body), body
+    return body, ""
+
+
+def _part_text(part: Message) -> str:
+    """Decode a text part with its declared charset.
+    
+    Fixes latin-1/iso-8859-15 merchant emails that a hardcoded UTF-8 decode
+    garbled; unknown or broken charsets fall back to lenient UTF-8.
+    """
+    try:
+        content = part.get_content()
+    except (LookupError, KeyError, ValueError):
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="ignore")
+    return content if isinstance(content, str) else content.decode("utf-8", errors="ignore")
+
+
+def _html_to_text(html_body: str) -> str:
+    """Extract visible text (no <style>/<script>/<head>) so the LLM window holds text, not markup."""
+    tree = LexborHTMLParser(html_body)
+    tree.strip_tags(["style", "script", "head"])
+    root = tree.body or tree.root
+    if not root:
+        return ""
+    return _LINE_BREAKS_RE.sub("\n", root.text(separator="\n")).strip()
+
+
+def _extract_attachments(msg) -> List[Tuple[str, bytes]]:
+    attachments: List[Tuple[str, bytes]] = []
+    
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_disposition() == "attachment" or part.get_content_type() == "application/pdf":
+                filename = part.get_filename()
+                if not filename:
+                    continue
+                
+                filename = str(filename)
+                if not filename.lower().endswith('.pdf'):
+                    continue
+                
+                try:
+                    payload = part.get_payload(decode=True)
+                    if payload:
+                        attachments.append((filename, payload))
+                except Exception as exc:
+                    logger.warning(f"Failed to decode attachment {filename}: {exc}")
+                    continue
+    
+    return attachments
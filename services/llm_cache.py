@@ -0,0 +1,49 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from utils.logger import logger
+
+LLM_CACHE_FILE = Path(__file__).parent.parent / ".llm_cache.sqlite"
+
+
+class LLMCache:
+    """SQLite cache of raw LLM responses keyed by a hash of the prompt."""
+    
+    def __init__(self, path: Path = LLM_CACHE_FILE):
+        """Open (and create if needed) the cache database.
+        
+        Args:
+            path: SQLite file path
+        """
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "content_hash TEXT PRIMARY KEY, response_json TEXT NOT NULL, created_at INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, if any."""
+        row = self.connection.execute(
+            "SELECT response_json FROM llm_responses WHERE content_hash = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def set(self, key: str, response_json: str) -> None:
+        """Store a response; cache write failures are logged, not raised."""
+        try:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?)",
+                (key, response_json, int(time.time())),
+            )
+            self.connection.commit()
+        except sqlite3.Error as exc:
+            logger.warning(f"Failed to write LLM cache: {exc}")
+
+
+def content_key(content: str) -> str:
+    """Hash content for cache keying (BLAKE2b, non-cryptographic use)."""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
@@ -1,60 +1,103 @@
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
+import ahocorasick
 import anthropic
-import json
+import httpx
+import orjson
+import time
+import uuid
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
 
+from services.llm_cache import LLMCache, content_key
+from services.models import Wine, as_text
 from utils.logger import logger
+from utils.retry import wait_retry_after
+import config
+
+PROMPT_CONTEXT_BEFORE = 4000
+PROMPT_CONTEXT_AFTER = 8000
+MIN_TEXT_LENGTH = 50
+
+HTTP_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+_TRANSIENT_ERRORS = retry_if_exception_type((
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    anthropic.APIConnectionError,
+))
 
 
 class WineLLMExtractor:
     """Extract wine order information using Claude."""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[LLMCache] = None):
         """Initialize LLM extractor.
         
         Args:
             api_key: Anthropic API key
+            cache: Optional response cache; cache hits don't count as LLM calls
         """
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = anthropic.Anthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultHttpxClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+            max_retries=0,
+        )
+        self.async_client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+            max_retries=0,
+        )
+        self.cache = cache
         self.call_count = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_keys: Dict[str, str] = {}
+        self._cached_results: Dict[str, Dict] = {}
+        self._batch_keys: Dict[str, Dict[str, str]] = {}
     
     def extract_wine_order(self, text: str, max_calls: int) -> Optional[Dict]:
-        """Extract wine order information from text using Claude."""
-        if self.call_count >= max_calls:
-            logger.warning(f"Reached maximum LLM calls limit ({max_calls})")
+        """Extract wine order information from text using Claude.
+        
+        Returns:
+            Order data (is_wine_order False for non-orders and texts too short
+            to hold one), or None if the call failed or the budget was spent
+        """
+        if _too_short(text):
+            return _not_an_order()
+        
+        cached = self._get_cached(text)
+        if cached:
+            return cached
+        
+        if not self._can_call(max_calls):
             return None
         
-        if not text or len(text.strip()) < 50:
+        try:
+            self.call_count += 1
+            message = self._create_message(self._build_request_params(text))
+            return self._parse_message(message, self._cache_key(text))
+        except anthropic.APIError as exc:
+            logger.error(f"Anthropic API error: {exc}")
+            return None
+        except Exception as exc:
+            logger.error(f"Unexpected error calling LLM: {exc}")
             return None
+    
+    async def extract_wine_order_async(self, text: str, max_calls: int) -> Optional[Dict]:
+        """Async variant of extract_wine_order, using the shared AsyncAnthropic client."""
+        if _too_short(text):
+            return _not_an_order()
         
-        prompt = self._build_extraction_prompt(text)
+        cached = self._get_cached(text)
+        if cached:
+            return cached
+        
+        if not self._can_call(max_calls):
+            return None
         
         try:
             self.call_count += 1
-            
-            message = self.client.messages.create(
-                model="claude-sonnet-4-5",
-                max_tokens=2000,
-                temperature=0,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
-            
-            if not message.content or not message.content[0].text:
-                logger.error("LLM returned empty content")
-                return None
-            
-            response_text = message.content[0].text
-            
-            parsed = self._parse_response_json(response_text)
-            if not parsed:
-                return None
-            
-            return parsed
-            
+            message = await self._create_message_async(self._build_request_params(text))
+            return self._parse_message(message, self._cache_key(text))
         except anthropic.APIError as exc:
             logger.error(f"Anthropic API error: {exc}")
             return None
@@ -62,6 +105,172 @@ class WineLLMExtractor:
             logger.error(f"Unexpected error calling LLM: {exc}")
             return None
     
+    def queue_extraction(self, text: str, max_calls: int) -> Optional[str]:
+        """Queue an extraction for the next flush() instead of calling Claude right away.
+        
+        Returns:
+            Request ID to look up in flush() results, or None if the budget was spent
+        """
+        request_id = uuid.uuid4().hex
+        
+        cached = _not_an_order() if _too_short(text) else self._get_cached(text)
+        if cached:
+            self._cached_results[request_id] = cached
+            return request_id
+        
+        if not self._can_call(max_calls):
+            return None
+        
+        self.call_count += 1
+        self._pending_keys[request_id] = self._cache_key(text)
+        self._pending.append({
+            "custom_id": request_id,
+            "params": self._build_request_params(text),
+        })
+        return request_id
+    
+    def flush(self, poll_interval: float = 10.0, timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Submit queued extractions as one Message Batch and wait for its results.
+        
+        Args:
+            poll_interval: Seconds between batch status checks
+            timeout: Seconds to wait for the batch, default config.LLM_BATCH_TIMEOUT
+            
+        Returns:
+            Parsed results keyed by request ID; failed requests are left out
+        """
+        results, self._cached_results = self._cached_results, {}
+        batch_id = self.submit_batch()
+        if batch_id:
+            results.update(self.poll_batch(batch_id, poll_interval, timeout))
+        return results
+    
+    def submit_batch(self) -> Optional[str]:
+        """Submit queued extractions as one Message Batch without waiting for it.
+        
+        Returns:
+            Batch ID to pass to poll_batch(), or None if nothing was submitted
+        """
+        if not self._pending:
+            return None
+        
+        requests, self._pending = self._pending, []
+        keys, self._pending_keys = self._pending_keys, {}
+        
+        try:
+            batch = self.client.messages.batches.create(requests=requests)
+        except anthropic.APIError as exc:
+            logger.error(f"Anthropic batch API error: {exc}")
+            return None
+        except Exception as exc:
+            logger.error(f"Unexpected error submitting LLM batch: {exc}")
+            return None
+        
+        logger.info(f"Submitted LLM batch {batch.id} with {len(requests)} requests")
+        self._batch_keys[batch.id] = keys
+        return batch.id
+    
+    def poll_batch(self, batch_id: str, poll_interval: float = 10.0, timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Wait for a submitted batch to end and parse its results.
+        
+        A batch still running after the timeout is logged and abandoned: its
+        requests get no result, so their messages stay pending for the next run.
+        
+        Args:
+            batch_id: ID returned by submit_batch()
+            poll_interval: Seconds between batch status checks
+            timeout: Seconds to wait for the batch, default config.LLM_BATCH_TIMEOUT
+            
+        Returns:
+            Parsed results keyed by request ID; failed requests are left out
+        """
+        keys = self._batch_keys.pop(batch_id, {})
+        results = {}
+        if timeout is None:
+            timeout = config.LLM_BATCH_TIMEOUT
+        deadline = time.monotonic() + timeout
+        
+        try:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            while batch.processing_status != "ended":
+                if time.monotonic() >= deadline:
+                    logger.warning(
+                        f"LLM batch {batch_id} still {batch.processing_status} after {timeout:.0f}s; "
+                        f"leaving its {len(keys)} requests for the next run"
+                    )
+                    return results
+                time.sleep(poll_interval)
+                batch = self.client.messages.batches.retrieve(batch_id)
+            
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type != "succeeded":
+                    logger.error(f"LLM batch request {entry.custom_id} {entry.result.type}")
+                    continue
+                parsed = self._parse_message(entry.result.message, keys.get(entry.custom_id))
+                if parsed:
+                    results[entry.custom_id] = parsed
+        except anthropic.APIError as exc:
+            logger.error(f"Anthropic batch API error: {exc}")
+        except Exception as exc:
+            logger.error(f"Unexpected error running LLM batch: {exc}")
+        
+        return results
+    
+    @retry(retry=_TRANSIENT_ERRORS, wait=wait_retry_after, stop=stop_after_attempt(6), reraise=True)
+    def _create_message(self, params: Dict[str, Any]):
+        """Call the Messages API, backing off on rate limits and server errors."""
+        return self.client.messages.create(**params)
+    
+    @retry(retry=_TRANSIENT_ERRORS, wait=wait_retry_after, stop=stop_after_attempt(6), reraise=True)
+    async def _create_message_async(self, params: Dict[str, Any]):
+        """Async variant of _create_message."""
+        return await self.async_client.messages.create(**params)
+    
+    def _can_call(self, max_calls: int) -> bool:
+        """Check the call budget."""
+        if self.call_count >= max_calls:
+            logger.warning(f"Reached maximum LLM calls limit ({max_calls})")
+            return False
+        return True
+    
+    def _build_request_params(self, text: str) -> Dict[str, Any]:
+        """Build Messages API parameters for one extraction."""
+        return {
+            "model": "claude-sonnet-4-5",
+            "max_tokens": 2000,
+            "temperature": 0,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": self._build_extraction_prompt(text)
+                }
+            ],
+        }
+    
+    def _parse_message(self, message, cache_key: Optional[str] = None) -> Optional[Dict]:
+        """Parse a Messages API response into order data, caching it when valid."""
+        if not message.content or not message.content[0].text:
+            logger.error("LLM returned empty content")
+            return None
+        
+        response_text = message.content[0].text
+        parsed = self._parse_response_json(response_text)
+        if parsed and self.cache and cache_key:
+            self.cache.set(cache_key, response_text)
+        return parsed
+    
+    def _cache_key(self, text: str) -> str:
+        """Cache key for a text: hash of the exact prompt sent to Claude."""
+        return content_key(self._build_extraction_prompt(text))
+    
+    def _get_cached(self, text: str) -> Optional[Dict]:
+        """Return the cached extraction for a text, if any."""
+        if not self.cache or not text:
+            return None
+        
+        cached = self.cache.get(self._cache_key(text))
+        return self._parse_response_json(cached) if cached else None
+    
     def _build_extraction_prompt(self, text: str) -> str:
         """Build prompt for wine order extraction.
         
@@ -109,7 +318,7 @@ Réponds UNIQUEMENT avec ce JSON:
 }}
 
 Email:
-{text[:12000]}
+{_relevant_region(text)}
 """
         
         return prompt
@@ -129,8 +338,8 @@ Email:
             text = text[start:end]
         
         try:
-            data = json.loads(text)
-        except json.JSONDecodeError as exc:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError as exc:
             logger.error(f"Failed to parse LLM JSON: {exc}")
             return None
         
@@ -145,26 +354,9 @@ Email:
             logger.error("LLM response 'wines' is not a list")
             return None
         
-        sanitized_wines = []
-        for wine in wines:
-            if not isinstance(wine, dict):
-                continue
-            sanitized_wines.append({
-                'région': str(wine.get('région', '') or ''),
-                'aoc': str(wine.get('aoc', '') or ''),
-                'producteur': str(wine.get('producteur', '') or ''),
-                'millésime': str(wine.get('millésime', '') or ''),
-                'cuvée': str(wine.get('cuvée', '') or ''),
-                'couleur': str(wine.get('couleur', '') or ''),
-                'pays': str(wine.get('pays', '') or ''),
-                'format': str(wine.get('format', '') or ''),
-                'quantité': str(wine.get('quantité', '') or ''),
-                'prix_unitaire': str(wine.get('prix_unitaire', '') or ''),
-            })
-        
-        data['wines'] = sanitized_wines
-        data['order_number'] = str(data.get('order_number', '') or '')
-        data['total_price'] = str(data.get('total_price', '') or '')
+        data['wines'] = [Wine.from_fields(wine) for wine in wines if isinstance(wine, dict)]
+        data['order_number'] = as_text(data.get('order_number'))
+        data['total_price'] = as_text(data.get('total_price'))
         
         return data
     
@@ -179,3 +371,48 @@ Email:
             Number of calls made
         """
         return self.call_count
+
+
+def _too_short(text: str) -> bool:
+    return not text or len(text.strip()) < MIN_TEXT_LENGTH
+
+
+def _not_an_order() -> Dict[str, Any]:
+    """Result for texts too short to hold an order; distinct from None (call failed or skipped)."""
+    return {'is_wine_order': False, 'order_number': '', 'total_price': '', 'wines': []}
+
+
+def _relevant_region(text: str) -> str:
+    """Window of the text centered on the first wine keyword, instead of its first 12000 chars.
+    
+    HTML emails often start with long headers/menus, which pushed the order
+    table out of a plain prefix slice.
+    """
+    for end_index, keyword in _KEYWORD_AUTOMATON.iter(_lower_in_place(text)):
+        start = max(0, end_index - len(keyword) + 1 - PROMPT_CONTEXT_BEFORE)
+        return text[start:start + PROMPT_CONTEXT_BEFORE + PROMPT_CONTEXT_AFTER]
+    
+    return text[:PROMPT_CONTEXT_BEFORE + PROMPT_CONTEXT_AFTER]
+
+
+def _lower_in_place(text: str) -> str:
+    """Lowercase text without changing its length, so match offsets index the original.
+    
+    str.lower() expands a few characters (e.g. 'İ' becomes 'i̇'); those are
+    kept as-is in the rare texts that contain one.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    automaton = ahocorasick.Automaton()
+    for keyword in config.WINE_ORDER_KEYWORDS:
+        automaton.add_word(keyword.lower(), keyword.lower())
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
@@ -0,0 +1,79 @@
+"""Order and wine records passed between extraction and export."""
+
+import re
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+_QUANTITY_RE = re.compile(r"\d+")
+
+_FIELD_NAMES = {
+    'région': 'region',
+    'millésime': 'millesime',
+    'cuvée': 'cuvee',
+    'quantité': 'quantity',
+    'prix_unitaire': 'unit_price',
+}
+
+
+@dataclass(slots=True)
+class Wine:
+    region: str = ""
+    aoc: str = ""
+    producteur: str = ""
+    millesime: str = ""
+    cuvee: str = ""
+    couleur: str = ""
+    pays: str = ""
+    format: str = ""
+    quantity: int = 0
+    unit_price: str = ""
+    
+    @classmethod
+    def from_fields(cls, fields: Dict[str, Any]) -> "Wine":
+        """Build a wine from extraction fields, keyed by the French names used in the prompt.
+        
+        Low-cardinality columns are interned so wines from the same region or
+        producer share one string object.
+        """
+        values = {_FIELD_NAMES.get(key, key): value for key, value in fields.items()}
+        return cls(
+            region=sys.intern(as_text(values.get('region'))),
+            aoc=sys.intern(as_text(values.get('aoc'))),
+            producteur=sys.intern(as_text(values.get('producteur'))),
+            millesime=as_text(values.get('millesime')),
+            cuvee=as_text(values.get('cuvee')),
+            couleur=sys.intern(as_text(values.get('couleur'))),
+            pays=sys.intern(as_text(values.get('pays'))),
+            format=sys.intern(as_text(values.get('format'))),
+            quantity=_as_quantity(values.get('quantity')),
+            unit_price=as_text(values.get('unit_price')),
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class Order:
+    message_id: Optional[str] = None
+    date: Optional[datetime] = None
+    sender: str = ""
+    subject: str = ""
+    order_number: str = ""
+    total_price: str = ""
+    wines: List[Wine] = field(default_factory=list)
+    source: str = ""
+
+
+def as_text(value: Any) -> str:
+    """Coerce a JSON value to str; strings (the common case) are returned as-is."""
+    if isinstance(value, str):
+        return value
+    return str(value or '')
+
+
+def _as_quantity(value: Any) -> int:
+    """Bottle count from an int or a string like "6" / "6 bouteilles"; 0 if unknown."""
+    if isinstance(value, int):
+        return value
+    match = _QUANTITY_RE.search(as_text(value))
+    return int(match.group()) if match else 0
@@ -1,68 +1,226 @@
-import io
-from PyPDF2 import PdfReader
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import ahocorasick
+import pypdfium2 as pdfium
 
 from utils.logger import logger
 
+ORDER_INDICATORS = [
+    'devis',
+    'facture',
+    'commande',
+    'bon de livraison',
+    'invoice',
+    'order',
+    'quantité',
+    'prix',
+    'total',
+]
+
+WINE_INDICATORS = [
+    'bouteille',
+    'vin',
+    'domaine',
+    'château',
+    'appellation',
+    'millésime',
+    'rouge',
+    'blanc',
+    'rosé',
+]
+
+MAX_PDF_BYTES = 8 * 1024 * 1024
+MERCHANT_PDF_HINTS = (
+    'facture',
+    'commande',
+    'devis',
+    'invoice',
+    'order',
+    'bon',
+)
+PDF_TEXT_CACHE_SIZE = 256
+PDF_PARSE_WORKERS = 4
+
+_text_cache: Dict[bytes, str] = {}
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+_pdfium_lock = threading.Lock()
+
 
 def extract_text_from_pdf(pdf_content: bytes) -> str:
     """Extract text content from PDF bytes.
     
+    Results are memoized by content digest, so the same attachment forwarded
+    or quoted across a thread is only parsed once.
+    
     Args:
         pdf_content: PDF file content as bytes
         
     Returns:
         Extracted text
     """
-    try:
-        pdf_file = io.BytesIO(pdf_content)
-        reader = PdfReader(pdf_file)
-        
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        
-        return text
-    except Exception as e:
-        logger.error(f"Error extracting PDF: {e}")
-        return ""
+    digest = hashlib.blake2b(pdf_content, digest_size=16).digest()
+    cached = _text_cache.get(digest)
+    if cached is not None:
+        return cached
+    
+    text = _parse_pdf_text(pdf_content)
+    _cache_text(digest, text)
+    return text
+
+
+def find_wine_order_pdf(pdf_contents: List[bytes]) -> Optional[str]:
+    """Return the text of the first PDF that looks like a wine order, if any.
+    
+    Several uncached PDFs are parsed in parallel worker processes (PDFium is
+    not thread-safe) and the remaining parses are cancelled on the first hit.
+    If a worker dies, the PDFs it left unparsed are parsed inline instead.
+    Safe to call from several threads: in-process parses take _pdfium_lock.
+    """
+    pending = []
+    for content in pdf_contents:
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        cached = _text_cache.get(digest)
+        if cached is None:
+            pending.append((digest, content))
+        elif is_wine_order_pdf(cached):
+            return cached
+    
+    if len(pending) > 1:
+        text, pending = _find_in_pool(pending)
+        if text is not None:
+            return text
+    
+    for _, content in pending:
+        text = extract_text_from_pdf(content)
+        if is_wine_order_pdf(text):
+            return text
+    return None
+
+
+def has_order_filename(filename: str) -> bool:
+    """Check if a PDF filename hints at an order document (facture, commande...)."""
+    lowered = filename.lower()
+    return any(hint in lowered for hint in MERCHANT_PDF_HINTS)
 
 
 def is_wine_order_pdf(text: str) -> bool:
     """Check if PDF contains wine order information.
     
+    Both indicator groups are matched in a single Aho-Corasick pass.
+    
     Args:
         text: Extracted PDF text
         
     Returns:
         True if likely a wine order
     """
-    order_indicators = [
-        'devis',
-        'facture',
-        'commande',
-        'bon de livraison',
-        'invoice',
-        'order',
-        'quantité',
-        'prix',
-        'total',
-    ]
+    found_groups = set()
+    for _, group in _INDICATOR_AUTOMATON.iter(text.lower()):
+        found_groups.add(group)
+        if len(found_groups) == 2:
+            return True
     
-    wine_indicators = [
-        'bouteille',
-        'vin',
-        'domaine',
-        'château',
-        'appellation',
-        'millésime',
-        'rouge',
-        'blanc',
-        'rosé',
-    ]
+    return False
+
+
+def _cache_text(digest: bytes, text: str) -> None:
+    if len(_text_cache) >= PDF_TEXT_CACHE_SIZE:
+        _text_cache.pop(next(iter(_text_cache)), None)
+    _text_cache[digest] = text
+
+
+def _find_in_pool(pending: List[Tuple[bytes, bytes]]) -> Tuple[Optional[str], List[Tuple[bytes, bytes]]]:
+    """Parse (digest, content) pairs in worker processes.
     
-    text_lower = text.lower()
+    Returns:
+        (text of the first wine-order PDF or None, pairs left unparsed because
+        a worker died and broke the pool)
+    """
+    pool = _get_parse_pool()
+    try:
+        futures = {pool.submit(_parse_pdf_text, content): (digest, content) for digest, content in pending}
+    except BrokenProcessPool:
+        logger.warning("PDF parse pool is broken; parsing inline")
+        _discard_parse_pool(pool)
+        return None, pending
     
-    has_order_indicator = any(indicator in text_lower for indicator in order_indicators)
-    has_wine_indicator = any(indicator in text_lower for indicator in wine_indicators)
+    unparsed = []
+    not_done = set(futures)
+    while not_done:
+        done, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                text = future.result()
+            except BrokenProcessPool:
+                unparsed.append(futures[future])
+                continue
+            except Exception as e:
+                logger.error(f"Error extracting PDF: {e}")
+                continue
+            _cache_text(futures[future][0], text)
+            if is_wine_order_pdf(text):
+                for other in not_done:
+                    other.cancel()
+                return text, []
+    
+    if unparsed:
+        logger.warning(f"A PDF parse worker died; parsing {len(unparsed)} PDFs inline")
+        _discard_parse_pool(pool)
+    return None, unparsed
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PDF_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def _discard_parse_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next call starts a fresh one (unless another thread already did)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False)
+
+
+def _parse_pdf_text(pdf_content: bytes) -> str:
+    """Extract the text of every page with PDFium.
     
-    return has_order_indicator and has_wine_indicator
+    PDFium is not thread-safe and pypdfium2 takes no lock of its own, so
+    in-process calls (e.g. from executor threads) are serialised by
+    _pdfium_lock; worker processes each have their own PDFium.
+    """
+    try:
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_content)
+            try:
+                return "".join(page.get_textpage().get_text_range() + "\n" for page in pdf)
+            finally:
+                pdf.close()
+    except Exception as e:
+        logger.error(f"Error extracting PDF: {e}")
+        return ""
+
+
+def _build_indicator_automaton() -> ahocorasick.Automaton:
+    automaton = ahocorasick.Automaton()
+    for group, indicators in (("order", ORDER_INDICATORS), ("wine", WINE_INDICATORS)):
+        for indicator in indicators:
+            automaton.add_word(indicator, group)
+    automaton.make_automaton()
+    return automaton
+
+
+_INDICATOR_AUTOMATON = _build_indicator_automaton()
@@ -1,28 +1,68 @@
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Set, Tuple
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+import json
+import os
+import re
+from urllib.parse import quote
 
-import gspread
+import orjson
+import requests
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
+from tenacity import retry, retry_if_exception, stop_after_attempt
+from urllib3.exceptions import NewConnectionError
 
+from services.models import Order
 from utils.logger import logger
+from utils.retry import wait_retry_after
 import config
 
 LAST_SYNC_FILE = Path(__file__).parent.parent / ".last_sync"
+LAST_UID_FILE = Path(__file__).parent.parent / ".last_uid"
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+APPEND_MAX_BYTES = 9 * 1024 * 1024
+SHEETS_APPEND_URL = "https://sheets.googleapis.com/v4/spreadsheets/{sheet_id}/values/{range}:append"
 
+_FORMAT_RE = re.compile(r"(jeroboam|300|magnum|1\.5|150|75)", re.IGNORECASE)
+_FORMAT_SIZES = {
+    "jeroboam": "300",
+    "300": "300",
+    "magnum": "150",
+    "1.5": "150",
+    "150": "150",
+    "75": "75",
+}
 
+_sheets_state = {"session": None, "creds_mtime": None}
+_last_saved: datetime | None = None
+
+
+@lru_cache(maxsize=128)
 def _normalize_format(format_value: str) -> str:
-    """Convert format strings to numeric centimeters (75/150/300)."""
+    """Convert format strings to numeric centimeters (75/150/300); cached, formats repeat a lot."""
     if not format_value:
         return ""
-    fmt = format_value.lower()
-    if "jeroboam" in fmt or "300" in fmt:
-        return "300"
-    if "magnum" in fmt or "150" in fmt or "1.5" in fmt:
-        return "150"
-    if "75" in fmt:
-        return "75"
-    return ""
+    match = _FORMAT_RE.search(format_value)
+    return _FORMAT_SIZES[match.group(1).lower()] if match else ""
+
+
+def _get_session() -> AuthorizedSession:
+    """Return the cached authorized session, re-authorizing only if the service account file changed.
+    
+    One keep-alive HTTP session is reused for the whole process; failures are
+    not cached.
+    """
+    creds_mtime = os.path.getmtime(config.GOOGLE_SERVICE_ACCOUNT_FILE)
+    if _sheets_state["session"] is not None and _sheets_state["creds_mtime"] == creds_mtime:
+        return _sheets_state["session"]
+    
+    creds = Credentials.from_service_account_file(config.GOOGLE_SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    session = AuthorizedSession(creds)
+    session.headers["Accept-Encoding"] = "gzip"
+    _sheets_state.update(session=session, creds_mtime=creds_mtime)
+    return session
 
 
 def get_last_sync_date() -> datetime | None:
@@ -36,58 +76,184 @@ def get_last_sync_date() -> datetime | None:
 
 
 def save_last_sync_date(date: datetime) -> None:
-    """Save the last sync date to file."""
-    LAST_SYNC_FILE.write_text(date.isoformat())
+    """Save the last sync date to file; skipped if it is unchanged since the last save."""
+    global _last_saved
+    if date == _last_saved:
+        return
+    _atomic_write_text(LAST_SYNC_FILE, date.isoformat())
+    _last_saved = date
+
+
+def get_last_uid(uidvalidity: int, mailbox: str = "INBOX") -> int | None:
+    """Get the last synced IMAP UID, or None if UIDVALIDITY changed since it was saved.
+    
+    Every message up to this UID has been processed.
+    """
+    return _get_uid_state(uidvalidity, mailbox).get("last_uid")
+
+
+def get_synced_uids(uidvalidity: int, mailbox: str = "INBOX") -> Set[int]:
+    """Get UIDs above the last synced UID that were already processed (past a failed message)."""
+    return set(_get_uid_state(uidvalidity, mailbox).get("synced_uids", ()))
 
 
-def append_wines_to_sheet(wine_orders: List[Dict]) -> None:
-    """Append wine rows to the configured Google Sheet."""
+def save_last_uid(
+    uidvalidity: int,
+    last_uid: int | None,
+    mailbox: str = "INBOX",
+    synced_uids: Iterable[int] = (),
+) -> None:
+    """Save the last synced IMAP UID and the processed UIDs above it, with the mailbox UIDVALIDITY."""
+    try:
+        states = json.loads(LAST_UID_FILE.read_text()) if LAST_UID_FILE.exists() else {}
+    except Exception:
+        states = {}
+    states[mailbox] = {
+        "uidvalidity": uidvalidity,
+        "last_uid": last_uid,
+        "synced_uids": sorted(synced_uids),
+    }
+    _atomic_write_text(LAST_UID_FILE, json.dumps(states))
+
+
+def _get_uid_state(uidvalidity: int, mailbox: str) -> dict:
+    if not LAST_UID_FILE.exists():
+        return {}
+    try:
+        state = json.loads(LAST_UID_FILE.read_text()).get(mailbox, {})
+    except Exception:
+        return {}
+    return state if state.get("uidvalidity") == uidvalidity else {}
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write via a fsynced temp file and os.replace, so a crash never leaves a truncated watermark."""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def append_wines_to_sheet(wine_orders: List[Order], update_sync_date: bool = True) -> bool:
+    """Append wine rows to the configured Google Sheet.
+    
+    Orders dated at or before the last sync date are dropped, so overlapping
+    fetch windows never upload the same wines twice. Undated orders are kept,
+    as main._is_new keeps undated messages.
+    
+    Args:
+        wine_orders: Orders to export
+        update_sync_date: Advance the last sync date; False when some messages
+            of the run are still pending, so the next run still looks at them
+    
+    Returns:
+        False if the sheet could not be initialized or written, True otherwise
+    """
+    last_sync = get_last_sync_date()
+    if last_sync:
+        new_orders = []
+        for order in wine_orders:
+            if order.date and order.date <= last_sync:
+                logger.info(f"Skipped order {order.message_id} dated {order.date}, already synced (<= {last_sync}).")
+            else:
+                new_orders.append(order)
+        wine_orders = new_orders
+
     if not wine_orders:
         logger.info("No wine orders to export.")
-        return
+        return True
 
     try:
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        creds = Credentials.from_service_account_file(
-            config.GOOGLE_SERVICE_ACCOUNT_FILE,
-            scopes=scopes,
-        )
-        client = gspread.authorize(creds)
-        worksheet = client.open_by_key(config.GOOGLE_SHEET_ID).worksheet(
-            config.GOOGLE_SHEET_WORKSHEET
-        )
+        session = _get_session()
     except Exception as exc:
         logger.error(f"Failed to initialize Google Sheets: {exc}")
-        return
-
-    rows: List[List[str]] = []
-    latest_date: datetime | None = None
-    
-    for order in wine_orders:
-        for wine in order.get("wines", []):
-            rows.append([
-                wine.get("région", ""),
-                wine.get("aoc", ""),
-                wine.get("producteur", ""),
-                wine.get("millésime", ""),
-                wine.get("cuvée", ""),
-                _normalize_format(wine.get("format", "")),
-            ])
-        
-        order_date = order.get("date")
-        if order_date and (not latest_date or order_date > latest_date):
-            latest_date = order_date
-
-    if not rows:
-        logger.info("No wines to append.")
-        return
+        return False
 
+    appended = 0
     try:
-        worksheet.append_rows(rows, value_input_option="USER_ENTERED")
-        logger.info(f"Appended {len(rows)} rows to Google Sheet.")
-        
-        if latest_date:
-            save_last_sync_date(latest_date)
-            logger.info(f"Updated last sync date: {latest_date}")
+        for body, row_count in _append_bodies(_row_iter(wine_orders)):
+            _append_rows_safe(session, body)
+            appended += row_count
     except Exception as exc:
-        logger.error(f"Failed to append rows: {exc}")
+        logger.error(f"Failed to append rows ({appended} rows appended before the failure): {exc}")
+        return False
+
+    if not appended:
+        logger.info("No wines to append.")
+        return True
+    logger.info(f"Appended {appended} rows to Google Sheet.")
+
+    latest_date = max((order.date for order in wine_orders if order.date), default=None)
+    if latest_date and update_sync_date:
+        save_last_sync_date(latest_date)
+        logger.info(f"Updated last sync date: {latest_date}")
+    return True
+
+
+def _row_iter(wine_orders: List[Order]) -> Iterator[List[str]]:
+    """Yield one sheet row per wine without materializing the whole list."""
+    return (
+        [wine.region, wine.aoc, wine.producteur, wine.millesime, wine.cuvee, _normalize_format(wine.format)]
+        for order in wine_orders
+        for wine in order.wines
+    )
+
+
+def _append_bodies(rows: Iterator[List[str]]) -> Iterator[Tuple[bytes, int]]:
+    """Yield values.append JSON bodies and their row counts, each under APPEND_MAX_BYTES.
+    
+    Rows are encoded once and packed into as few requests as the 10 MB request
+    limit allows, so a whole backfill is usually a single round-trip.
+    """
+    encoded: List[bytes] = []
+    size = 0
+    for row in rows:
+        data = orjson.dumps(row)
+        if encoded and size + len(data) > APPEND_MAX_BYTES:
+            yield b'{"values":[' + b",".join(encoded) + b"]}", len(encoded)
+            encoded, size = [], 0
+        encoded.append(data)
+        size += len(data) + 1
+    if encoded:
+        yield b'{"values":[' + b",".join(encoded) + b"]}", len(encoded)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Retry only failures where the append cannot have been applied.
+    
+    values.append with INSERT_ROWS is not idempotent: a 5xx or a read timeout
+    may arrive after Sheets has written the rows, so retrying could duplicate
+    them. Rate limits and failures to connect (nothing was sent) are safe.
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code == 429
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.ConnectionError):
+        reason = getattr(exc.args[0], "reason", None) if exc.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+@retry(
+    retry=retry_if_exception(_is_transient),
+    wait=wait_retry_after,
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+def _append_rows_safe(session: AuthorizedSession, body: bytes) -> None:
+    """Append one encoded chunk of rows with a Sheets v4 values.append call, retrying unsent requests."""
+    url = SHEETS_APPEND_URL.format(
+        sheet_id=config.GOOGLE_SHEET_ID,
+        range=quote(f"{config.GOOGLE_SHEET_WORKSHEET}!A1", safe=""),
+    )
+    response = session.post(
+        url,
+        params={"valueInputOption": "USER_ENTERED", "insertDataOption": "INSERT_ROWS"},
+        data=body,
+        headers={"Content-Type": "application/json"},
+        timeout=60,
+    )
+    response.raise_for_status()
@@ -0,0 +1,21 @@
+"""Deterministic order extractors for merchants with stable HTML emails."""
+
+from typing import Callable, Dict, Optional
+
+from services.templates import chaisdoeuvre, idealwine
+
+TEMPLATES: Dict[str, Callable[[str], Optional[Dict]]] = {
+    "idealwine.com": idealwine.extract,
+    "idealwine.fr": idealwine.extract,
+    "chaisdoeuvre.com": chaisdoeuvre.extract,
+    "chaisdoeuvre.fr": chaisdoeuvre.extract,
+}
+
+
+def find_template(domain: str) -> Optional[Callable[[str], Optional[Dict]]]:
+    """Return the template for a sender domain or any of its parent domains."""
+    while domain:
+        if domain in TEMPLATES:
+            return TEMPLATES[domain]
+        domain = domain.partition(".")[2]
+    return None
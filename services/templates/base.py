@@ -0,0 +1,109 @@
+"""Shared parsing for merchant order-confirmation templates."""
+
+import re
+from typing import Dict, List, Optional, Pattern, Sequence, Tuple
+
+from selectolax.lexbor import LexborHTMLParser
+
+from services.models import Wine
+
+_VINTAGE_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+_SPACES_RE = re.compile(r"\s+")
+
+# Exported sheet columns the LLM always fills; a template missing any of them defers to the LLM
+REQUIRED_FIELDS = ('region', 'aoc', 'producteur', 'cuvee')
+DEFAULT_FORMAT = '75cl'
+
+
+def extract_order_table(
+    html: str,
+    columns: Sequence[Tuple[str, str]],
+    confirmation_re: Pattern,
+    order_number_re: Pattern,
+    total_re: Pattern,
+) -> Optional[Dict]:
+    """Extract an order from the first table whose header matches the merchant's columns.
+    
+    Emails without an order-confirmation marker (newsletters, promos), or
+    whose table leaves an exported column (REQUIRED_FIELDS) empty, are left to
+    the LLM.
+    
+    Args:
+        html: Raw HTML email body
+        columns: (header prefix, wine field) pairs, first match wins
+        confirmation_re: Pattern that only order confirmations contain
+        order_number_re: Pattern capturing the order number in the email text
+        total_re: Pattern capturing the order total in the email text
+    
+    Returns:
+        Order data shaped like an LLM result, or None if the layout doesn't match
+    """
+    if not html:
+        return None
+    
+    tree = LexborHTMLParser(html)
+    root = tree.body or tree.root
+    if not root:
+        return None
+    
+    text = _SPACES_RE.sub(" ", root.text(separator=" "))
+    if not confirmation_re.search(text):
+        return None
+    order_match = order_number_re.search(text)
+    if not order_match:
+        return None
+    
+    wines = []
+    for table in tree.css("table"):
+        wines = _table_wines(table, columns)
+        if wines:
+            break
+    if not wines or any(not getattr(wine, name) for wine in wines for name in REQUIRED_FIELDS):
+        return None
+    
+    total_match = total_re.search(text)
+    return {
+        'is_wine_order': True,
+        'order_number': order_match.group(1),
+        'total_price': total_match.group(1).strip() if total_match else '',
+        'wines': wines,
+    }
+
+
+def _table_wines(table, columns: Sequence[Tuple[str, str]]) -> List[Wine]:
+    """Read wine rows below the header row of a table, if it has one."""
+    mapping = None
+    wines = []
+    for row in table.css("tr"):
+        cells = [_cell_text(cell) for cell in row.iter() if cell.tag in ("td", "th")]
+        if mapping is None:
+            mapping = _header_mapping(cells, columns)
+            continue
+        wine = {field: cells[index] for index, field in mapping.items() if index < len(cells)}
+        if not wine.get('cuvée') or not wine.get('quantité', '').isdigit():
+            continue
+        if not wine.get('millésime'):
+            vintage = _VINTAGE_RE.search(wine['cuvée'])
+            wine['millésime'] = vintage.group(1) if vintage else ''
+        if not wine.get('format'):
+            wine['format'] = DEFAULT_FORMAT
+        wines.append(Wine.from_fields(wine))
+    return wines
+
+
+def _header_mapping(cells: List[str], columns: Sequence[Tuple[str, str]]) -> Optional[Dict[int, str]]:
+    """Map cell index to wine field when a row is the item table's header row."""
+    mapping = {}
+    for index, cell in enumerate(cells):
+        label = cell.lower()
+        for prefix, field in columns:
+            if label.startswith(prefix) and field not in mapping.values():
+                mapping[index] = field
+                break
+    if 'cuvée' not in mapping.values() or 'quantité' not in mapping.values():
+        return None
+    return mapping
+
+
+def _cell_text(cell) -> str:
+    return _SPACES_RE.sub(" ", cell.text(separator=" ")).strip()
@@ -0,0 +1,32 @@
+"""iDealwine order confirmation template."""
+
+import re
+from typing import Dict, Optional
+
+from services.templates.base import extract_order_table
+
+COLUMNS = (
+    ("désignation", "cuvée"),
+    ("vin", "cuvée"),
+    ("producteur", "producteur"),
+    ("domaine", "producteur"),
+    ("région", "région"),
+    ("region", "région"),
+    ("appellation", "aoc"),
+    ("aoc", "aoc"),
+    ("millésime", "millésime"),
+    ("format", "format"),
+    ("contenance", "format"),
+    ("quantité", "quantité"),
+    ("qté", "quantité"),
+    ("prix unitaire", "prix_unitaire"),
+    ("prix", "prix_unitaire"),
+)
+CONFIRMATION_RE = re.compile(r"(?:confirmation|récapitulatif) de (?:votre )?commande|merci pour votre commande", re.IGNORECASE)
+ORDER_NUMBER_RE = re.compile(r"commande\s*(?:n°|no\b|numéro)\s*:?\s*((?=[A-Z-]*\d)[A-Z0-9][A-Z0-9-]{3,})", re.IGNORECASE)
+TOTAL_RE = re.compile(r"total\s*(?:ttc)?\s*:?\s*([\d\s.,]+\s*€)", re.IGNORECASE)
+
+
+def extract(html: str) -> Optional[Dict]:
+    """Extract an iDealwine order, or None if the email isn't an order confirmation."""
+    return extract_order_table(html, COLUMNS, CONFIRMATION_RE, ORDER_NUMBER_RE, TOTAL_RE)
@@ -1,8 +1,13 @@
 """Wine order detection service."""
 
-from typing import Dict, List, Optional
-from services.pdf_parser import extract_text_from_pdf, is_wine_order_pdf
+import asyncio
+from email.utils import parseaddr
+from typing import Dict, List, Optional, Set, Tuple
+from services.pdf_parser import MAX_PDF_BYTES, find_wine_order_pdf, has_order_filename
 from services.llm_extractor import WineLLMExtractor
+from services.models import Order
+from services.templates import find_template
+from utils.logger import logger
 
 
 class WineOrderDetector:
@@ -12,57 +17,210 @@ class WineOrderDetector:
         self, 
         keywords: List[str], 
         merchant_domains: List[str],
-        llm_extractor: Optional[WineLLMExtractor] = None
+        llm_extractor: Optional[WineLLMExtractor] = None,
+        batch_mode: bool = False
     ):
-        self.merchant_domains = [d.lower() for d in merchant_domains]
+        """Initialize the detector.
+        
+        Args:
+            keywords: Unused, kept for compatibility
+            merchant_domains: Known wine merchant sender domains
+            llm_extractor: Optional LLM extractor; without it only templates are used
+            batch_mode: Queue LLM extractions for finalize_batch() instead of calling Claude per email
+        """
+        self.merchant_domains = frozenset(d.lower() for d in merchant_domains)
+        self._domain_suffixes = tuple("." + d for d in sorted(self.merchant_domains))
         self.llm_extractor = llm_extractor
+        self.batch_mode = batch_mode
+        self._queued: Dict[str, Tuple[Dict, str]] = {}
+        self._template_orders: List[Order] = []
+        self.unresolved_ids: Set[str] = set()
     
     def is_wine_order(self, message_data: Dict) -> bool:
-        """Quick pre-filter: only process emails from known wine merchants."""
-        from_email = message_data.get('from', '').lower()
-        return any(domain in from_email for domain in self.merchant_domains)
-    
-    def extract_order_details(self, message_data: Dict, max_llm_calls: int = 50) -> Optional[Dict]:
-        """Extract order details using LLM."""
-        body = message_data.get('body', '')
-        attachments = message_data.get('attachments', [])
+        """Quick pre-filter: only process emails from known wine merchants.
         
-        pdf_text = ""
-        for filename, content in attachments:
-            if filename.lower().endswith('.pdf'):
-                extracted = extract_text_from_pdf(content)
-                if is_wine_order_pdf(extracted):
-                    pdf_text = extracted
-                    break
+        Matches the sender's address domain (or a subdomain of it), not any
+        substring of the From header, so e.g. "totalwine.com" no longer
+        matches "wine.com" and display names can't trigger a match. Exact
+        domains hit the set; subdomains need one tuple str.endswith call.
+        """
+        domain = _sender_domain(message_data)
+        if not domain:
+            return False
+        return domain in self.merchant_domains or domain.endswith(self._domain_suffixes)
+    
+    def extract_order_details(self, message_data: Dict, max_llm_calls: int = 50) -> Optional[Order]:
+        """Extract order details with the sender's template, falling back to the LLM.
         
-        text_to_parse = pdf_text if pdf_text else body
+        In batch mode the LLM extraction is queued and None is returned; the
+        order comes back from finalize_batch(). Messages whose extraction failed
+        or was skipped are added to unresolved_ids.
+        """
+        if self.batch_mode:
+            self.queue_order_details(message_data, max_llm_calls)
+            return None
         
+        template_order = self._extract_with_template(message_data)
+        if template_order:
+            return template_order
         if not self.llm_extractor:
+            self.unresolved_ids.add(message_data.get('id'))
             return None
         
+        text_to_parse, from_pdf = self._select_text(message_data)
         llm_result = self.llm_extractor.extract_wine_order(text_to_parse, max_llm_calls)
+        return self._llm_order(message_data, llm_result, _llm_source(from_pdf))
+    
+    async def extract_order_details_async(self, message_data: Dict, max_llm_calls: int = 50) -> Optional[Order]:
+        """Async variant of extract_order_details.
         
-        if not llm_result:
+        PDF selection runs in the default executor; concurrent PDFium parses are
+        serialised by pdf_parser's lock while the LLM calls still overlap.
+        """
+        template_order = self._extract_with_template(message_data)
+        if template_order:
+            return template_order
+        if not self.llm_extractor:
+            self.unresolved_ids.add(message_data.get('id'))
             return None
         
-        if not llm_result.get('is_wine_order', False):
+        loop = asyncio.get_running_loop()
+        text_to_parse, from_pdf = await loop.run_in_executor(None, self._select_text, message_data)
+        llm_result = await self.llm_extractor.extract_wine_order_async(text_to_parse, max_llm_calls)
+        return self._llm_order(message_data, llm_result, _llm_source(from_pdf))
+    
+    def extract_order_details_many(
+        self, messages: List[Dict], max_llm_calls: int = 50, max_concurrent: int = 8
+    ) -> List[Order]:
+        """Extract orders from many messages with concurrent LLM calls; sync wrapper."""
+        return asyncio.run(self.extract_order_details_many_async(messages, max_llm_calls, max_concurrent))
+    
+    async def extract_order_details_many_async(
+        self, messages: List[Dict], max_llm_calls: int = 50, max_concurrent: int = 8
+    ) -> List[Order]:
+        """Extract orders from many messages, with at most max_concurrent LLM calls in flight.
+        
+        A failing message is logged and skipped instead of aborting the others.
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+        
+        async def extract_one(message_data: Dict) -> Optional[Order]:
+            async with semaphore:
+                return await self.extract_order_details_async(message_data, max_llm_calls)
+        
+        results = await asyncio.gather(*(extract_one(m) for m in messages), return_exceptions=True)
+        
+        orders = []
+        for message_data, result in zip(messages, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to extract order from message {message_data.get('id')}: {result}")
+                self.unresolved_ids.add(message_data.get('id'))
+            elif result:
+                orders.append(result)
+        return orders
+    
+    def queue_order_details(self, message_data: Dict, max_llm_calls: int = 50) -> None:
+        """Queue a message for batched LLM extraction, resolved by finalize_batch().
+        
+        Template matches are resolved immediately and never reach the batch.
+        """
+        template_order = self._extract_with_template(message_data)
+        if template_order:
+            self._template_orders.append(template_order)
+            return
+        if not self.llm_extractor:
+            self.unresolved_ids.add(message_data.get('id'))
+            return
+        
+        text_to_parse, from_pdf = self._select_text(message_data)
+        request_id = self.llm_extractor.queue_extraction(text_to_parse, max_llm_calls)
+        if request_id:
+            self._queued[request_id] = (message_data, _llm_source(from_pdf))
+        else:
+            self.unresolved_ids.add(message_data.get('id'))
+    
+    def finalize_batch(self) -> List[Order]:
+        """Run all queued extractions in one LLM batch and return the wine orders found."""
+        orders, self._template_orders = self._template_orders, []
+        if not self.llm_extractor or not self._queued:
+            return orders
+        
+        queued, self._queued = self._queued, {}
+        results = self.llm_extractor.flush()
+        
+        for request_id, (message_data, source) in queued.items():
+            order = self._llm_order(message_data, results.get(request_id), source)
+            if order:
+                orders.append(order)
+        return orders
+    
+    def _extract_with_template(self, message_data: Dict) -> Optional[Order]:
+        """Parse the order with the sender domain's HTML template, if one exists and matches."""
+        template = find_template(_sender_domain(message_data))
+        html = message_data.get('html', '')
+        if not template or not html:
             return None
+        return self._build_order(message_data, template(html), 'template_email')
+    
+    def _select_text(self, message_data: Dict) -> Tuple[str, bool]:
+        """Pick the text to send to the LLM: a wine-order PDF if any, else the body.
+        
+        PDFs over MAX_PDF_BYTES are skipped, and when the email has a body only
+        PDFs with an order-like filename are parsed; smallest first.
+        
+        Returns:
+            (text, whether it comes from a PDF)
+        """
+        body = message_data.get('body', '')
+        attachments = message_data.get('attachments', [])
+        
+        pdfs = sorted(
+            (
+                content for filename, content in attachments
+                if filename.lower().endswith('.pdf')
+                and len(content) <= MAX_PDF_BYTES
+                and (not body or has_order_filename(filename))
+            ),
+            key=len,
+        )
+        extracted = find_wine_order_pdf(pdfs)
+        if extracted:
+            return extracted, True
         
-        wines = llm_result.get('wines', [])
-        
-        for wine in wines:
-            if 'quantité' in wine:
-                wine['quantity'] = wine.pop('quantité')
-            if 'prix_unitaire' in wine:
-                wine['unit_price'] = wine.pop('prix_unitaire')
-        
-        return {
-            'message_id': message_data.get('id'),
-            'date': message_data.get('date'),
-            'from': message_data.get('from'),
-            'subject': message_data.get('subject'),
-            'order_number': llm_result.get('order_number', ''),
-            'total_price': llm_result.get('total_price', ''),
-            'wines': wines,
-            'source': 'llm_' + ('pdf' if pdf_text else 'email'),
-        }
+        return body, False
+    
+    def _llm_order(self, message_data: Dict, llm_result: Optional[Dict], source: str) -> Optional[Order]:
+        """Build the order from an LLM result; a missing result marks the message unresolved."""
+        if llm_result is None:
+            self.unresolved_ids.add(message_data.get('id'))
+            return None
+        return self._build_order(message_data, llm_result, source)
+    
+    def _build_order(self, message_data: Dict, result: Optional[Dict], source: str) -> Optional[Order]:
+        """Build an Order from an LLM or template result, or None if it is not a wine order."""
+        if not result:
+            return None
+        
+        if not result.get('is_wine_order', False):
+            return None
+        
+        return Order(
+            message_id=message_data.get('id'),
+            date=message_data.get('date'),
+            sender=message_data.get('from', ''),
+            subject=message_data.get('subject', ''),
+            order_number=result.get('order_number', ''),
+            total_price=result.get('total_price', ''),
+            wines=result.get('wines', []),
+            source=source,
+        )
+
+
+def _sender_domain(message_data: Dict) -> str:
+    """Lowercased domain of the sender's address, or "" if there is none."""
+    _, address = parseaddr(message_data.get('from', ''))
+    return address.rpartition('@')[2].lower()
+
+
+def _llm_source(from_pdf: bool) -> str:
+    return 'llm_' + ('pdf' if from_pdf else 'email')
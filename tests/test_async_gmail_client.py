@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime
+from unittest import mock
+
+import aioimaplib
+
+from services.async_gmail_client import AsyncGmailClient
+
+
+def _client(search_lines):
+    client = AsyncGmailClient("me@example.com", "secret")
+    client.imap = mock.create_autospec(aioimaplib.IMAP4, instance=True)
+    client.imap.uid_search.return_value = aioimaplib.Response("OK", search_lines)
+    return client
+
+
+def test_search_message_ids_uses_uid_search():
+    client = _client([b"87 12 55 9", b"SEARCH completed (Success)"])
+    
+    uids = asyncio.run(client.search_message_ids(
+        max_results=3,
+        merchant_domains=["idealwine.com"],
+        since=datetime(2024, 3, 1),
+        after_uid=8,
+    ))
+    
+    assert uids == ["9", "12", "55"]
+    client.imap.uid_search.assert_awaited_once_with(
+        'UID', '9:*', 'SINCE', '01-Mar-2024', 'X-GM-RAW', '"from:(idealwine.com)"',
+    )
+    client.imap.search.assert_not_called()
+
+
+def test_search_message_ids_drops_the_uid_range_echo():
+    # "UID n:*" always matches the highest UID, even when it is below n
+    client = _client([b"8"])
+    
+    assert asyncio.run(client.search_message_ids(after_uid=8)) == []
+    client.imap.uid_search.assert_awaited_once_with('UID', '9:*')
+
+
+def test_search_message_ids_without_criteria_searches_all():
+    client = _client([b""])
+    
+    assert asyncio.run(client.search_message_ids()) == []
+    client.imap.uid_search.assert_awaited_once_with('ALL')
@@ -0,0 +1,73 @@
+from services.gmail_client import (
+    _FETCH_ID_RE,
+    build_gmail_raw_query,
+    fetch_section_name,
+    parse_message_parts,
+    quote_imap_string,
+)
+
+
+def test_fetch_id_reads_uid_from_first_line_of_a_message():
+    match = _FETCH_ID_RE.match(b"12 (UID 4821 BODY[HEADER] {342}")
+    assert match.group(1) == b"4821"
+
+
+def test_fetch_id_ignores_flags_before_uid():
+    match = _FETCH_ID_RE.match(b"3 (FLAGS (\\Seen) UID 77 RFC822 {1024}")
+    assert match.group(1) == b"77"
+
+
+def test_fetch_id_does_not_match_continuation_lines():
+    assert _FETCH_ID_RE.match(b" BODY[TEXT] {88}") is None
+
+
+def test_fetch_section_name():
+    assert fetch_section_name(b"12 (UID 4821 BODY[HEADER] {342}") == "HEADER"
+    assert fetch_section_name(b" BODY[TEXT] {88}") == "TEXT"
+    assert fetch_section_name(b"1 (UID 5 BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {120}") == "HEADER.FIELDS"
+    assert fetch_section_name(b"1 (UID 5 BODY[TEXT]<0> {2048}") == "TEXT"
+    assert fetch_section_name(b"1 (UID 5 RFC822 {4096}") == "RFC822"
+    assert fetch_section_name(b"1 (UID 5 FLAGS (\\Seen))") is None
+
+
+def test_parse_message_parts_decodes_headers_and_body():
+    header = (
+        b"From: =?utf-8?q?Ch=C3=A2teau?= <vente@chateau.fr>\r\n"
+        b"Subject: =?utf-8?b?Q29uZmlybWF0aW9uIGRlIGNvbW1hbmRl?=\r\n"
+        b"Content-Type: text/plain; charset=iso-8859-1\r\n"
+        b"Content-Transfer-Encoding: 8bit\r\n"
+        b"\r\n"
+    )
+    message = parse_message_parts({"HEADER": header, "TEXT": "Millésime 2019\r\n".encode("iso-8859-1")})
+    
+    assert message["Subject"] == "Confirmation de commande"
+    assert message["From"].addresses[0].display_name == "Château"
+    assert message.get_content().strip() == "Millésime 2019"
+
+
+def test_parse_message_parts_without_text_section():
+    message = parse_message_parts({"HEADER": b"Subject: Facture\r\n\r\n"})
+    
+    assert message["Subject"] == "Facture"
+    assert message.get_payload() == ""
+
+
+def test_build_gmail_raw_query():
+    query = build_gmail_raw_query(["idealwine.com", "purjus.fr"], ["commande de vin", "facture"])
+    
+    assert query == 'from:(idealwine.com OR purjus.fr) OR subject:("commande de vin" OR "facture")'
+    assert build_gmail_raw_query(["idealwine.com"], None) == "from:(idealwine.com)"
+    assert build_gmail_raw_query(None, []) == ""
+
+
+def test_build_gmail_raw_query_drops_quotes_inside_keywords():
+    query = build_gmail_raw_query(None, ['cuvée "Les Clos"'])
+    
+    assert query == 'subject:("cuvée Les Clos")'
+
+
+def test_quote_imap_string_escapes_quotes_and_backslashes():
+    query = build_gmail_raw_query(["idealwine.com"], ["facture"])
+    
+    assert quote_imap_string(query) == '"from:(idealwine.com) OR subject:(\\"facture\\")"'
+    assert quote_imap_string('a\\b') == '"a\\\\b"'
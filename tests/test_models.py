@@ -0,0 +1,34 @@
+import pytest
+
+from services.models import Wine, _as_quantity
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (6, 6),
+        ("6", 6),
+        ("12 bouteilles", 12),
+        ("x3", 3),
+        ("", 0),
+        (None, 0),
+        ("une caisse", 0),
+    ],
+)
+def test_as_quantity(value, expected):
+    assert _as_quantity(value) == expected
+
+
+def test_wine_from_fields_maps_french_keys():
+    wine = Wine.from_fields({
+        'région': 'Bourgogne',
+        'aoc': 'Chablis',
+        'millésime': 2021,
+        'cuvée': 'Vaillons',
+        'quantité': '6 bouteilles',
+        'prix_unitaire': '32,00 €',
+        'inconnu': None,
+    })
+    
+    assert (wine.region, wine.aoc, wine.millesime, wine.cuvee) == ('Bourgogne', 'Chablis', '2021', 'Vaillons')
+    assert (wine.quantity, wine.unit_price, wine.producteur) == (6, '32,00 €', '')
@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from services import pdf_parser
+
+
+def _pdf(text: str) -> bytes:
+    """Minimal one-page PDF showing text in Helvetica."""
+    stream = f"BT /F1 12 Tf 20 100 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 300 200] /Contents 4 0 R"
+        b" /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    body = b"".join(b"%d 0 obj\n" % number + obj + b"\nendobj\n" for number, obj in enumerate(objects, 1))
+    return b"%PDF-1.4\n" + body + b"trailer\n<< /Root 1 0 R >>\n%%EOF\n"
+
+
+NEWSLETTER = _pdf("Nos nouveautes de printemps")
+INVOICE = _pdf("Facture: 6 bouteilles de vin rouge, total 90")
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(pdf_parser, "_text_cache", {})
+    monkeypatch.setattr(pdf_parser, "_parse_pool", None)
+    yield
+    if pdf_parser._parse_pool is not None:
+        pdf_parser._parse_pool.shutdown()
+
+
+def _broken_pool() -> ProcessPoolExecutor:
+    pool = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+    return pool
+
+
+class _DyingPool:
+    """Pool whose worker dies on every PDF it is given."""
+    
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+    
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_single_pdf_is_parsed_inline():
+    assert "6 bouteilles" in pdf_parser.find_wine_order_pdf([INVOICE])
+    assert pdf_parser._parse_pool is None
+
+
+def test_broken_pool_falls_back_to_inline_parsing():
+    pdf_parser._parse_pool = _broken_pool()
+    
+    text = pdf_parser.find_wine_order_pdf([NEWSLETTER, INVOICE])
+    
+    assert "6 bouteilles" in text
+    assert pdf_parser._parse_pool is None
+
+
+def test_worker_dying_mid_parse_falls_back_to_inline_parsing():
+    pdf_parser._parse_pool = _DyingPool()
+    
+    assert "6 bouteilles" in pdf_parser.find_wine_order_pdf([NEWSLETTER, INVOICE])
+    assert pdf_parser._parse_pool is None
+    assert pdf_parser.find_wine_order_pdf([NEWSLETTER, _pdf("Bonjour")]) is None
+
+
+def test_concurrent_callers_share_one_pool():
+    barrier = threading.Barrier(8)
+    pools = []
+    
+    def get_pool():
+        barrier.wait()
+        pools.append(pdf_parser._get_parse_pool())
+    
+    threads = [threading.Thread(target=get_pool) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len({id(pool) for pool in pools}) == 1
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from tenacity import RetryCallState
+
+from utils.retry import MAX_RETRY_WAIT, wait_retry_after
+
+
+def _state(exc: BaseException, attempt: int = 1) -> RetryCallState:
+    state = RetryCallState(None, None, (), {})
+    state.attempt_number = attempt
+    state.set_exception((type(exc), exc, None))
+    return state
+
+
+class _ResponseError(Exception):
+    def __init__(self, headers):
+        super().__init__("HTTP error")
+        self.response = SimpleNamespace(headers=headers)
+
+
+def test_wait_retry_after_honours_the_header():
+    assert wait_retry_after(_state(_ResponseError({"retry-after": "7"}))) == 7.0
+
+
+def test_wait_retry_after_caps_long_waits():
+    assert wait_retry_after(_state(_ResponseError({"retry-after": "3600"}))) == MAX_RETRY_WAIT
+
+
+def test_wait_retry_after_backs_off_without_a_usable_header():
+    for exc in (_ResponseError({}), _ResponseError({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}), OSError()):
+        for attempt in range(1, 8):
+            assert 0 <= wait_retry_after(_state(exc, attempt)) <= MAX_RETRY_WAIT
@@ -0,0 +1,64 @@
+import orjson
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from services import sheets_client
+from services.sheets_client import _append_bodies, _is_transient
+
+
+def test_append_bodies_packs_all_rows_into_one_request():
+    rows = [["Loire", "Anjou", "Richard Leroy", "2020", "Les Noëls", "75"], ["Rhône", "", "", "", "", ""]]
+    
+    (body, count), = _append_bodies(iter(rows))
+    
+    assert count == 2
+    assert orjson.loads(body) == {"values": rows}
+
+
+def test_append_bodies_splits_at_the_size_limit(monkeypatch):
+    rows = [[f"cuvée {index}", "x" * 10] for index in range(5)]
+    row_size = len(orjson.dumps(rows[0]))
+    monkeypatch.setattr(sheets_client, "APPEND_MAX_BYTES", 2 * row_size + 1)
+    
+    bodies = list(_append_bodies(iter(rows)))
+    
+    assert [count for _, count in bodies] == [2, 2, 1]
+    assert [row for body, _ in bodies for row in orjson.loads(body)["values"]] == rows
+
+
+def test_append_bodies_sends_an_oversized_row_on_its_own(monkeypatch):
+    rows = [["a" * 20], ["b" * 200], ["c" * 20]]
+    monkeypatch.setattr(sheets_client, "APPEND_MAX_BYTES", len(orjson.dumps(rows[0])) + 1)
+    
+    bodies = list(_append_bodies(iter(rows)))
+    
+    assert [orjson.loads(body)["values"] for body, _ in bodies] == [[rows[0]], [rows[1]], [rows[2]]]
+
+
+def test_append_bodies_yields_nothing_for_no_rows():
+    assert list(_append_bodies(iter([]))) == []
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (_http_error(429), True),
+        (_http_error(500), False),
+        (_http_error(503), False),
+        (_http_error(400), False),
+        (requests.ConnectTimeout(), True),
+        (requests.ReadTimeout(), False),
+        (requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused"))), True),
+        (requests.ConnectionError(ProtocolError("Connection aborted.")), False),
+        (ValueError(), False),
+    ],
+)
+def test_only_unsent_or_rate_limited_appends_are_retried(exc, expected):
+    assert _is_transient(exc) is expected
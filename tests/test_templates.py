@@ -0,0 +1,62 @@
+from pathlib import Path
+
+from services.templates import chaisdoeuvre, find_template, idealwine
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def _fixture(name: str) -> str:
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def test_idealwine_extracts_a_confirmation():
+    order = idealwine.extract(_fixture("idealwine_confirmation.html"))
+    
+    assert order["is_wine_order"] is True
+    assert order["order_number"] == "IW-2024-00123"
+    assert order["total_price"] == "744,00 €"
+    first, second = order["wines"]
+    assert (first.cuvee, first.producteur, first.region, first.aoc) == (
+        "Clos des Papes 2019", "Paul Avril", "Vallée du Rhône", "Châteauneuf-du-Pape",
+    )
+    assert (first.millesime, first.format, first.quantity) == ("2019", "75cl", 6)
+    assert (second.millesime, second.format, second.quantity) == ("2020", "Magnum", 1)
+
+
+def test_idealwine_rejects_a_newsletter():
+    assert idealwine.extract(_fixture("idealwine_newsletter.html")) is None
+
+
+def test_template_defers_to_the_llm_when_an_exported_column_is_blank():
+    html = _fixture("idealwine_confirmation.html").replace("<td>Loire</td>", "<td></td>")
+    
+    assert idealwine.extract(html) is None
+
+
+def test_template_requires_an_order_number():
+    html = _fixture("idealwine_confirmation.html").replace("n° IW-2024-00123", "")
+    
+    assert idealwine.extract(html) is None
+
+
+def test_chaisdoeuvre_extracts_a_confirmation():
+    html = """
+    <p>Merci pour votre achat ! Commande #CDO48213</p>
+    <table>
+      <tr><td>Produit</td><td>Producteur</td><td>Région</td><td>AOC</td><td>Millésime</td><td>Quantité</td><td>Prix</td></tr>
+      <tr><td>Les Vignes de Mon Père</td><td>Rostaing</td><td>Rhône</td><td>Côte-Rôtie</td><td>2018</td><td>3</td><td>95,00 €</td></tr>
+    </table>
+    <p>Total de la commande : 285,00 €</p>
+    """
+    order = chaisdoeuvre.extract(html)
+    
+    assert order["order_number"] == "CDO48213"
+    assert order["total_price"] == "285,00 €"
+    (wine,) = order["wines"]
+    assert (wine.producteur, wine.aoc, wine.millesime, wine.quantity) == ("Rostaing", "Côte-Rôtie", "2018", 3)
+
+
+def test_find_template_walks_parent_domains():
+    assert find_template("mail.idealwine.com") is idealwine.extract
+    assert find_template("chaisdoeuvre.fr") is chaisdoeuvre.extract
+    assert find_template("purjus.fr") is None
@@ -0,0 +1,64 @@
+import pytest
+
+import main
+from services import sheets_client
+from services.gmail_client import MAX_SEARCH_RESULTS
+from services.sheets_client import get_last_uid, get_synced_uids, save_last_uid
+
+
+@pytest.fixture(autouse=True)
+def uid_file(tmp_path, monkeypatch):
+    path = tmp_path / ".last_uid"
+    monkeypatch.setattr(sheets_client, "LAST_UID_FILE", path)
+    return path
+
+
+def test_uid_state_round_trip():
+    save_last_uid(7, 120, synced_uids={125, 123})
+    
+    assert get_last_uid(7) == 120
+    assert get_synced_uids(7) == {123, 125}
+
+
+def test_changed_uidvalidity_discards_the_state():
+    save_last_uid(7, 120, synced_uids={125})
+    
+    assert get_last_uid(8) is None
+    assert get_synced_uids(8) == set()
+
+
+def test_mailboxes_are_saved_separately():
+    save_last_uid(7, 120)
+    save_last_uid(9, 40, mailbox="[Gmail]/All Mail")
+    
+    assert get_last_uid(7) == 120
+    assert get_last_uid(9, mailbox="[Gmail]/All Mail") == 40
+
+
+def test_corrupt_state_file_means_a_full_sync(uid_file):
+    uid_file.write_text("{not json")
+    
+    assert get_last_uid(7) is None
+
+
+def test_uid_watermark_stops_at_the_first_unprocessed_uid():
+    assert main._uid_watermark(2, ["3", "4", "5", "6"], {3, 5, 6}) == 3
+    assert main._uid_watermark(2, ["3", "4"], set()) == 2
+    assert main._uid_watermark(None, ["10", "9"], {9, 10}) == 10
+
+
+def test_search_limit_never_exceeds_the_search_cap(monkeypatch):
+    monkeypatch.setattr(main.config, "GMAIL_MAX_RESULTS", 100)
+    
+    assert main._search_limit({1, 2, 3}) == 103
+    assert main._search_limit(set(range(450))) == MAX_SEARCH_RESULTS
+
+
+def test_failed_message_is_retried_without_redoing_the_rest():
+    main._save_uid_state(7, 2, set(), ["3", "4", "5", "6"], ["3", "5", "6"])
+    
+    assert main._get_uid_state(7) == (3, {5, 6})
+    
+    main._save_uid_state(7, 3, {5, 6}, ["4", "5", "6", "7"], ["4", "7"])
+    
+    assert main._get_uid_state(7) == (7, set())
@@ -0,0 +1,22 @@
+"""Retry helpers shared by the Sheets and LLM clients."""
+
+from tenacity import RetryCallState, wait_random_exponential
+
+MAX_RETRY_WAIT = 60.0
+
+_backoff = wait_random_exponential(min=1, max=MAX_RETRY_WAIT)
+
+
+def wait_retry_after(retry_state: RetryCallState) -> float:
+    """Wait as long as the server's Retry-After header asks, else exponential backoff with jitter.
+    
+    Works with any exception exposing a ``response.headers`` mapping
+    (requests.HTTPError, anthropic.APIStatusError).
+    """
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after")), MAX_RETRY_WAIT)
+    except (TypeError, ValueError):
+        return _backoff(retry_state)